@@ -0,0 +1,402 @@
+"""
+_merge_core.py
+
+Shared machinery behind merge_dataset_1.py and merge_dataset_2.py: discovering images and
+labels, placing images in the output (hardlink / reflink / copy), remapping label class ids,
+and the per-split and whole-merge drivers. The two scripts only differ in which datasets
+they pick, which class id each one maps to and how split folders may be named.
+"""
+
+import argparse
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+SPLITS = ("train", "valid", "test")
+
+# Lowercase, without the dot, matched against the text after a file name's last "."
+IMG_EXTS = frozenset({"jpg", "jpeg", "png", "bmp", "webp", "tif", "tiff"})
+
+# How images reach the output folder: share inodes, clone blocks, or copy bytes
+LINK_MODES = ("hardlink", "reflink", "copy")
+
+# Per-file work is syscall-bound, so oversubscribe the cores
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Label files where every line is 1-8 printable-ASCII tokens joined by single spaces.
+# For these the general remap in remap_labels only swaps the leading class token
+# (9+ tokens would be split into several boxes), so one regex pass does the whole file.
+_SIMPLE_LABELS = re.compile(rb"(?:[!-~]+(?: [!-~]+){0,7}\n)*")
+_LEAD_TOKEN = re.compile(rb"^\S+", re.MULTILINE)
+
+
+def make_dirs(p: Path):
+    p.mkdir(parents=True, exist_ok=True)
+
+
+def sanitize_prefix(name: str) -> str:
+    return name.replace(os.sep, "_").replace(" ", "_").replace(".", "_")
+
+
+def find_split_dirs(
+    dataset_dir: Path, split_key: str, split_aliases: Dict[str, List[str]]
+) -> Tuple[Optional[Path], Optional[Path]]:
+    for alias in split_aliases[split_key]:
+        images_dir = dataset_dir / alias / "images"
+        labels_dir = dataset_dir / alias / "labels"
+        if images_dir.exists() and images_dir.is_dir():
+            return images_dir, labels_dir if labels_dir.exists() else None
+    return None, None
+
+
+def _scan_files(path):
+    """Recursively yield os.DirEntry objects for the files under path.
+
+    DirEntry carries the file type from the directory read itself, so unlike
+    Path.rglob + is_file this needs no extra stat per entry (symlinks aside).
+    Symlinked directories are not descended into, same as rglob.
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path)
+            elif entry.is_file():
+                yield entry
+
+
+def iter_images(images_dir: Path, exts: Optional[frozenset] = IMG_EXTS):
+    """Yield the image entries under images_dir; exts=None accepts every file."""
+    for entry in _scan_files(images_dir):
+        if exts is None:
+            yield entry
+            continue
+        stem, _, ext = entry.name.rpartition(".")
+        if stem and ext.lower() in exts:
+            yield entry
+
+
+def iter_label_files(labels_dir: Optional[Path]):
+    if not labels_dir:
+        return
+    for entry in _scan_files(labels_dir):
+        if entry.name.endswith(".txt"):
+            yield entry
+
+
+def _last_per_name(entries: List[os.DirEntry]) -> Tuple[List[os.DirEntry], List[os.DirEntry]]:
+    """Split entries into the last one seen for each file name and the ones it overrides.
+
+    Subfolders are flattened into one output folder, so files sharing a name collide.
+    Copying them in order used to leave the last one in place; keeping only that one
+    gives the same result and stops worker threads from writing the same path at once.
+    """
+    by_name = {}
+    for entry in entries:
+        by_name[entry.name] = entry
+    if len(by_name) == len(entries):
+        return entries, []
+    return list(by_name.values()), [e for e in entries if by_name[e.name] is not e]
+
+
+def positive_int(value: str) -> int:
+    """argparse type for --workers: an int of at least 1."""
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
+
+
+def _zero_copy(src: os.DirEntry, dst: str):
+    """Copy file contents in kernel space and keep only the mtime.
+
+    Tries os.copy_file_range (a copy-on-write clone on btrfs/XFS), then os.sendfile,
+    then a plain userspace copy, resuming from wherever the previous method stopped.
+    Unlike shutil.copy2 there is no chmod/xattr copying; training only needs the bytes.
+    """
+    with open(src, "rb") as fsrc, open(dst, "xb") as fdst:
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        # fstat on the open fd: DirEntry.stat() would be a path stat on POSIX anyway
+        st = os.fstat(infd)
+        done = 0
+        if hasattr(os, "copy_file_range"):
+            try:
+                while done < st.st_size:
+                    n = os.copy_file_range(infd, outfd, st.st_size - done)
+                    if n == 0:
+                        break
+                    done += n
+            except OSError:
+                pass  # e.g. EXDEV across filesystems on older kernels
+        if done < st.st_size and hasattr(os, "sendfile"):
+            try:
+                while done < st.st_size:
+                    n = os.sendfile(outfd, infd, done, st.st_size - done)
+                    if n == 0:
+                        break
+                    done += n
+            except OSError:
+                pass  # e.g. macOS, where sendfile only writes to sockets
+        if done < st.st_size:
+            fsrc.seek(done)
+            fdst.seek(done)
+            shutil.copyfileobj(fsrc, fdst)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _place(src: os.DirEntry, dst: str, link_mode: str):
+    if link_mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except FileExistsError:
+            raise
+        except OSError:
+            pass  # cross-device or filesystem without hardlinks
+    if link_mode == "copy":
+        # Bytes only: permissions, xattrs and mtimes are not carried over (training never looks at them)
+        shutil.copyfile(src, dst)
+    else:
+        _zero_copy(src, dst)
+
+
+def _fast_link(src: os.DirEntry, dst: str, link_mode: str = "hardlink"):
+    """Put src at dst, sharing data blocks instead of copying bytes when the filesystem allows.
+
+    "hardlink" falls back to _zero_copy when linking fails (e.g. across devices),
+    "reflink" goes straight to _zero_copy and "copy" uses shutil.copyfile, which on
+    Python 3.8+ is itself a sendfile (Linux) / fcopyfile (macOS) fast copy.
+    An existing dst (e.g. from a previous run) is replaced, never written through,
+    so a hardlinked output can't truncate the source image.
+    """
+    try:
+        _place(src, dst, link_mode)
+    except (FileExistsError, shutil.SameFileError):
+        os.unlink(dst)
+        _place(src, dst, link_mode)
+
+
+def _read_bytes_fast(path) -> bytes:
+    """Read a small file in one os.read, skipping the buffered/text IO layers."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
+
+
+def _write_bytes_fast(path, data: bytes):
+    """Counterpart of _read_bytes_fast: write data with raw os.write, then rename it over path.
+
+    Going through a temp file means path only ever holds a complete file, and an existing
+    path is replaced rather than truncated.
+    """
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+    except BaseException:
+        # e.g. ENOSPC or Ctrl-C: don't leave a stray .tmp in the labels folder
+        os.unlink(tmp)
+        raise
+
+
+def remap_labels(data: bytes, target_id: int) -> bytes:
+    """Rewrite the contents of a YOLO label file so every box uses target_id.
+
+    The output holds exactly one normalised box per line.
+    """
+    # CRLF files are otherwise well-formed often enough to be worth the fast path too
+    data = data.replace(b"\r\n", b"\n")
+    if data and not data.endswith(b"\n"):
+        data += b"\n"
+    if _SIMPLE_LABELS.fullmatch(data):
+        return _LEAD_TOKEN.sub(str(target_id).encode(), data)
+
+    lines = data.decode("utf-8").splitlines()
+    # One growing buffer instead of a list of lines joined at the end
+    buf = bytearray()
+    tid_str = str(target_id)
+    tid_prefix = (tid_str + " ").encode()
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        parts = line.split()
+        # Handle possible multiple bbox entries on a single line (some files concatenate bboxes):
+        # YOLO format per bbox: class x_center y_center width height => 5 tokens
+        # If a line has more than 5 tokens, split the trailing tokens into 4-number bbox chunks and write multiple lines.
+        n = len(parts)
+        if n == 5:
+            # Single bbox, by far the most common shape: no chunking needed
+            parts[0] = tid_str
+            buf += " ".join(parts).encode("utf-8")
+            buf += b"\n"
+        elif n > 5:
+            vals = parts[1:]
+            if len(vals) % 4 == 0:
+                # multiple 4-number bbox chunks
+                for i in range(0, len(vals), 4):
+                    bbox = vals[i:i+4]
+                    buf += tid_prefix
+                    buf += " ".join(bbox).encode("utf-8")
+                    buf += b"\n"
+            else:
+                # Unexpected format: fallback to replacing only the class id
+                parts[0] = tid_str
+                buf += " ".join(parts).encode("utf-8")
+                buf += b"\n"
+        else:
+            # Malformed/short line — replace class token if present or skip
+            if parts:
+                parts[0] = tid_str
+                buf += " ".join(parts).encode("utf-8")
+                buf += b"\n"
+    return bytes(buf)
+
+
+def _process_label(lab: os.DirEntry, dest: str, target_id: int) -> int:
+    """Remap one label file to target_id and write it to dest; returns the number of boxes."""
+    # Read and remap
+    out = remap_labels(_read_bytes_fast(lab), target_id)
+    _write_bytes_fast(dest, out)
+    return out.count(b"\n")
+
+
+def _count_boxes(lab: os.DirEntry, target_id: int) -> int:
+    """Number of boxes _process_label would write for lab, without writing anything."""
+    return remap_labels(_read_bytes_fast(lab), target_id).count(b"\n")
+
+
+def process_split(
+    dataset_dir: Path,
+    split_key: str,
+    out_images: Path,
+    out_labels: Path,
+    prefix: str,
+    target_id: int,
+    class_counts: List[int],
+    *,
+    split_aliases: Dict[str, List[str]],
+    image_exts: Optional[frozenset] = IMG_EXTS,
+    dry_run: bool = False,
+    link_mode: str = "hardlink",
+    workers: int = DEFAULT_WORKERS,
+):
+    images_dir, labels_dir = find_split_dirs(dataset_dir, split_key, split_aliases)
+
+    if images_dir is None:
+        print(f"[WARN] Missing split '{split_key}' in {dataset_dir}. Checked {split_aliases[split_key]}")
+        return 0, 0, 0
+
+    imgs = list(iter_images(images_dir, image_exts))
+    if not imgs:
+        print(f"[WARN] No images under {images_dir}")
+    if labels_dir is None:
+        print(f"[INFO] No labels directory for split '{split_key}' in {dataset_dir}")
+    lbls = list(iter_label_files(labels_dir))
+
+    # Same-named files from different subfolders would land on one destination
+    imgs_kept, imgs_dropped = _last_per_name(imgs)
+    lbls_kept, lbls_dropped = _last_per_name(lbls)
+    if imgs_dropped:
+        print(f"[WARN] {len(imgs_dropped)} images under {images_dir} share a file name with a later one; keeping the last of each")
+    if lbls_dropped:
+        print(f"[WARN] {len(lbls_dropped)} labels under {labels_dir} share a file name with a later one; keeping the last of each")
+
+    if dry_run:
+        # Preview only: no destination paths, no writes, just the counts a real run would report
+        bbox_written = sum(_count_boxes(lab, target_id) for lab in lbls)
+        class_counts[target_id] += bbox_written
+        return len(imgs), len(lbls), bbox_written
+
+    make_dirs(out_images)
+    make_dirs(out_labels)
+    # Per-file destinations are plain strings; Path objects stay at the API boundary
+    out_images_str = str(out_images)
+    out_labels_str = str(out_labels)
+    prefix_ = prefix + "_"
+
+    # File ops release the GIL, so a thread pool keeps the disk queue full
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        # Copy images: prefix filename to avoid collisions
+        dests = [os.path.join(out_images_str, prefix_ + img.name) for img in imgs_kept]
+        list(ex.map(_fast_link, imgs_kept, dests, repeat(link_mode)))
+
+        # Copy & remap labels
+        # New label file name mirrors prefixed image base name but .txt
+        dests = [os.path.join(out_labels_str, prefix_ + lab.name) for lab in lbls_kept]
+        box_counts = list(ex.map(_process_label, lbls_kept, dests, repeat(target_id)))
+
+    # Tally on this thread so class_counts is never shared between workers.
+    # Overridden labels still count, as they did when each one was written and then replaced.
+    bbox_written = sum(box_counts) + sum(_count_boxes(lab, target_id) for lab in lbls_dropped)
+    class_counts[target_id] += bbox_written
+
+    return len(imgs), len(lbls), bbox_written
+
+
+def merge(
+    out: Path,
+    datasets_with_ids: Sequence[Tuple[Path, int]],
+    unified_names: List[str],
+    *,
+    split_aliases: Dict[str, List[str]],
+    image_exts: Optional[frozenset] = IMG_EXTS,
+    dry_run: bool = False,
+    link_mode: str = "hardlink",
+    workers: int = DEFAULT_WORKERS,
+):
+    """Merge each (dataset folder, target class id) pair into out and write its data.yaml.
+
+    Returns (stats per dataset and split, {class_id: box count}, total boxes).
+    """
+    # Create output structure
+    for split in SPLITS:
+        make_dirs(out / split / "images")
+        make_dirs(out / split / "labels")
+
+    stats = {}
+    # Flat tally indexed by class id; only non-zero ids are reported
+    max_id = max((target_id for _, target_id in datasets_with_ids), default=0)
+    class_counts = [0] * max(len(unified_names), max_id + 1)
+    total_boxes = 0
+
+    for ds_path, target_id in datasets_with_ids:
+        prefix = sanitize_prefix(ds_path.name)
+        stats[ds_path.name] = {}
+
+        for split in SPLITS:
+            out_images = out / split / "images"
+            out_labels = out / split / "labels"
+            ci, cl, boxes = process_split(
+                ds_path, split, out_images, out_labels, prefix, target_id, class_counts,
+                split_aliases=split_aliases, image_exts=image_exts,
+                dry_run=dry_run, link_mode=link_mode, workers=workers,
+            )
+            total_boxes += boxes
+            stats[ds_path.name][split] = {"images_copied": ci, "labels_copied": cl, "boxes": boxes}
+
+    # Write merged data.yaml
+    data_yaml = out / "data.yaml"
+    yaml_lines = [
+        "train: train/images",
+        "val: valid/images",
+        "test: test/images",
+        "",
+        f"nc: {len(unified_names)}",
+        f"names: {unified_names}",
+    ]
+    if not dry_run:
+        data_yaml.write_text("\n".join(yaml_lines) + "\n", encoding="utf-8")
+
+    return stats, {cls_id: n for cls_id, n in enumerate(class_counts) if n}, total_boxes
@@ -9,12 +9,21 @@ import os
 import shutil
 import sys
 from pathlib import Path
+from typing import Sequence, Union
+
+COREML_SUFFIXES = {".mlmodel", ".mlpackage"}
 
 def parse_args():
     p = argparse.ArgumentParser()
     p.add_argument("--weights", type=str, default="best.pt", help="Path to .pt file")
     p.add_argument("--imgsz", type=int, default=640, help="Square input size")
-    p.add_argument("--half", action="store_true", help="Export in FP16")
+    p.add_argument(
+        "--precision",
+        choices=["fp16", "fp32"],
+        default="fp16",
+        help="Weight precision. FP16 lets Core ML run the model on the Neural Engine",
+    )
+    p.add_argument("--int8", action="store_true", help="Palettize weights to 8 bits (smaller model, overrides --precision)")
     p.add_argument("--no_nms", action="store_true", help="Export without built in NMS")
     p.add_argument("--outname", type=str, default="coreml", help="Base name for Core ML file")
     return p.parse_args()
@@ -33,6 +42,14 @@ def next_free_path(base: Path) -> Path:
             return candidate
         i += 1
 
+def find_coreml_path(x: Union[str, Path, Sequence]) -> Path:
+    """Pick the .mlmodel or .mlpackage out of what Ultralytics export returned (a path or a list of paths)."""
+    items = [x] if isinstance(x, (str, Path)) else x
+    found = next((p for p in map(Path, items) if p.suffix in COREML_SUFFIXES), None)
+    if found is None:
+        raise RuntimeError(f"Export did not produce a Core ML model (.mlmodel or .mlpackage): {x}")
+    return found
+
 def main():
     args = parse_args()
 
@@ -43,6 +60,14 @@ def main():
         print("Ultralytics is required. Install with: pip install ultralytics", file=sys.stderr)
         raise
 
+    # Ultralytics' Core ML int8 export palettizes weights with k-means, which needs scikit-learn
+    if args.int8:
+        try:
+            import sklearn  # noqa: F401
+        except ImportError:
+            print("--int8 needs scikit-learn. Install with: pip install scikit-learn", file=sys.stderr)
+            sys.exit(1)
+
     weights_p = Path(args.weights)
     if not weights_p.exists():
         print(f"Missing weights file: {weights_p}", file=sys.stderr)
@@ -54,31 +79,26 @@ def main():
     print("Exporting to Core ML")
     # nms is True by default for simplest app integration
     nms_flag = not args.no_nms
+    half_flag = args.precision == "fp16"
 
     # Run export
     export_out = model.export(
         format="coreml",
         imgsz=args.imgsz,
         nms=nms_flag,
-        half=args.half,
+        half=half_flag,
         dynamic=False,     # static input size is preferred for Core ML
-        int8=False,        # set True only if you have a calibration flow
+        int8=args.int8,    # 8-bit k-means weight palettization, applied before NMS is attached
         optimize=False,    # optional Core ML graph optimizations
         verbose=True
     )
 
     # Ultralytics returns a path or a list of paths. Find the .mlmodel or .mlpackage.
-    def find_coreml_path(x):
-        if isinstance(x, (list, tuple)):
-            for item in x:
-                p = Path(item)
-                if p.suffix == ".mlmodel" or p.suffix == ".mlpackage":
-                    return p
-            # if not found, fall back to first item
-            return Path(x[0])
-        return Path(x)
-
-    produced = find_coreml_path(export_out)
+    try:
+        produced = find_coreml_path(export_out)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
     if not produced.exists():
         print(f"Export completed but output file was not found: {produced}", file=sys.stderr)
         sys.exit(2)
@@ -92,18 +112,26 @@ def main():
     if produced.resolve() != target.resolve():
         if produced.is_dir():
             # .mlpackage is a directory
-            print(f"Copying {produced} to {target}")
             if target.exists():
                 print(f"Target already exists: {target}", file=sys.stderr)
                 sys.exit(3)
-            shutil.copytree(produced, target)
+            try:
+                # Same filesystem: link every file in the bundle instead of copying the weight blobs.
+                # The files then share inodes with the export output; this script does not write to it again.
+                shutil.copytree(produced, target, copy_function=os.link)
+                print(f"Hardlinked {produced} to {target}")
+            except OSError:
+                # e.g. EXDEV across devices; drop any partial tree and copy for real
+                shutil.rmtree(target, ignore_errors=True)
+                shutil.copytree(produced, target)
+                print(f"Copied {produced} to {target}")
         else:
             print(f"Copying {produced} to {target}")
             shutil.copy2(produced, target)
 
     print("\nDone.")
     print(f"Core ML model saved at: {target}")
-    print(f"Settings used: imgsz={args.imgsz} half={args.half} nms={nms_flag}")
+    print(f"Settings used: imgsz={args.imgsz} precision={args.precision} int8={args.int8} nms={nms_flag}")
     print("Tip. Keep the same preprocessing in your app as during training.")
 
 if __name__ == "__main__":